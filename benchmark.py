@@ -0,0 +1,612 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Sony Mobile Communications Inc.
+# SPDX-License-Identifier: MIT
+#
+"""
+Benchmark aosp-digest against local stand-ins of the Gerrit and smtp servers,
+and report throughput and peak memory of:
+- Gerrit.update, fetching paginated changes from the Gerrit stand-in
+- Cache.read and Cache.write of a synthetic cache
+- ColumnStore.from_cache and ColumnStore.summarize of a synthetic cache
+- OutputFormatter.format_html for a set of synthetic users
+- Mailer.main, sending emails of synthetic users to the smtp sink
+
+The Gerrit stand-in serves `a/changes/` pages either generated from synthetic
+changes, or replayed from fixtures recorded from a real Gerrit instance with:
+./benchmark.py --record <fixtures>
+(the Gerrit instance is taken from config.yaml), and replayed with:
+./benchmark.py --fixtures <fixtures>
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import shutil
+import socketserver
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from cache import Cache
+from columnar import ColumnStore
+from config import Config
+from daily_view import DailyView
+from gerrit import Gerrit
+from loader import load_user
+from output_formatter import OutputFormatter
+from send_email import Mailer
+
+PAGE_SIZE = 500
+DOMAINS = ["sony.com", "google.com", "linaro.org", "intel.com", "gmail.com"]
+
+
+def synthetic_changes(count, seed=0):
+    """
+    Generate `count` changes as returned by the `a/changes/` Gerrit endpoint.
+    """
+
+    rnd = random.Random(seed)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    projects = [f"platform/project{x}" for x in range(max(count // 50, 1))]
+    changes = []
+    for number in range(count):
+        updated = now - datetime.timedelta(seconds=rnd.randrange(5 * 24 * 3600))
+        name = f"Author {rnd.randrange(count // 10 + 1)}"
+        files = {
+            f"src/file{x}.c": {
+                "lines_inserted": rnd.randrange(100),
+                "lines_deleted": rnd.randrange(50),
+            }
+            for x in range(rnd.randrange(1, 6))
+        }
+        changes.append(
+            {
+                "_number": number + 1,
+                "project": rnd.choice(projects),
+                "subject": f"Synthetic change {number + 1}",
+                "updated": updated.strftime("%Y-%m-%d %H:%M:%S.%f") + "000",
+                "revisions": {
+                    f"{number + 1:040x}": {
+                        "commit": {
+                            "message": f"Synthetic change {number + 1}\n\nBody.\n",
+                            "author": {
+                                "name": name,
+                                "email": f"{name.replace(' ', '.').lower()}"
+                                f"@{rnd.choice(DOMAINS)}",
+                            },
+                        },
+                        "files": files,
+                    }
+                },
+            }
+        )
+    return changes
+
+
+def synthetic_pages(changes, page_size=PAGE_SIZE):
+    """
+    Split changes into Gerrit replies, keyed by the `start` query parameter.
+    """
+
+    pages = {}
+    for start in range(0, len(changes), page_size):
+        page = [dict(x) for x in changes[start : start + page_size]]
+        if start + page_size < len(changes):
+            page[-1]["_more_changes"] = True
+        pages[start] = ")]}'\n" + json.dumps(page)
+    return pages
+
+
+def synthetic_cache(changes):
+    """
+    Turn Gerrit replies into cache entries as written by Gerrit.update,
+    cached over the last 30 days.
+    """
+
+    now = datetime.datetime.now()
+    out = []
+    for (index, change) in enumerate(changes):
+        if not change["revisions"]:
+            continue
+        revision = list(change["revisions"].values())[-1]
+        files = revision["files"]
+        cached = now - datetime.timedelta(days=index % 30)
+        out.append(
+            {
+                "subject": change["subject"],
+                "updated": change["updated"],
+                "project": change["project"],
+                "message": revision["commit"]["message"],
+                "files": files,
+                "number": str(change["_number"]),
+                "author": dict(revision["commit"]["author"]),
+                "size": (
+                    sum(x.get("lines_inserted", 0) for x in files.values()),
+                    sum(x.get("lines_deleted", 0) for x in files.values()),
+                ),
+                "cached": cached.strftime("%Y-%m-%d %H:%M:%S.%f") + "000",
+            }
+        )
+    return out
+
+
+def write_users(dirname, count, projects, css, seed=0):
+    """
+    Write `count` synthetic users, each watching a few projects and a domain,
+    along with the default css.
+    """
+
+    rnd = random.Random(seed)
+    shutil.rmtree(os.path.join(dirname, "users"), ignore_errors=True)
+    os.makedirs(os.path.join(dirname, "users"))
+    with open(os.path.join(dirname, "users", "default.css"), "w") as fcss:
+        fcss.write(css)
+    for index in range(count):
+        watched = rnd.sample(projects, min(len(projects), 5))
+        domain = rnd.choice(DOMAINS)
+        with open(os.path.join(dirname, "users", f"user{index}.py"), "w") as fuser:
+            fuser.write(
+                f"EMAIL = 'user{index}@example.com'\n"
+                f"WATCHED_PROJECTS = {watched!r}\n"
+                "FILTERS = [\n"
+                "    ('Watched projects',\n"
+                "     lambda c: c['project'] in WATCHED_PROJECTS),\n"
+                "    ('Contributions per domain',\n"
+                f"     lambda c: c['domain'] == {domain!r}),\n"
+                "]\n"
+            )
+
+
+class GerritStandIn(ThreadingHTTPServer):
+    """
+    Local http server replying to `a/changes/` queries with pages keyed by
+    the `start` query parameter. Pages are loaded from a fixtures directory
+    or given directly. If `upstream` is set, missing pages are fetched from
+    the real Gerrit instance and recorded into the fixtures directory.
+    """
+
+    def __init__(self, pages=None, fixtures=None, upstream=None):
+        super().__init__(("127.0.0.1", 0), _GerritHandler)
+        self.pages = dict(pages or {})
+        self.fixtures = fixtures
+        self.upstream = upstream
+        if fixtures and os.path.isdir(fixtures) and not upstream:
+            for name in os.listdir(fixtures):
+                if name.startswith("page-"):
+                    with open(os.path.join(fixtures, name)) as fpage:
+                        self.pages[int(name[5:-5])] = fpage.read()
+
+    @property
+    def url(self):
+        """
+        Url to be used in place of Gerrit url.
+        """
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def page(self, path, start):
+        """
+        Return a page starting at given offset, recording it if needed.
+        """
+
+        if start not in self.pages and self.upstream:
+            response = requests.get(self.upstream + path.lstrip("/"))
+            self.pages[start] = response.text
+            os.makedirs(self.fixtures, exist_ok=True)
+            with open(os.path.join(self.fixtures, f"page-{start}.json"), "w") as fpage:
+                fpage.write(response.text)
+        return self.pages.get(start, ")]}'\n[]")
+
+
+class _GerritHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Reply to `a/changes/` queries with the page at the `start` offset.
+        """
+
+        url = urlparse(self.path)
+        if not url.path.startswith("/a/changes/"):
+            self.send_error(404)
+            return
+        start = int(parse_qs(url.query).get("start", ["0"])[0])
+        body = self.server.page(self.path, start).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """
+    Local smtp server accepting and discarding every email.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SmtpHandler)
+        self.received = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        """
+        Url to be used in place of smtp server url.
+        """
+        return f"127.0.0.1:{self.server_address[1]}"
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(b"220 sink ESMTP\r\n")
+        for line in self.rfile:
+            command = line[:4].upper()
+            if command == b"DATA":
+                self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                for data in self.rfile:
+                    if data == b".\r\n":
+                        break
+                with self.server.lock:
+                    self.server.received += 1
+                self.wfile.write(b"250 OK\r\n")
+            elif command == b"QUIT":
+                self.wfile.write(b"221 Bye\r\n")
+                return
+            else:
+                self.wfile.write(b"250 OK\r\n")
+
+
+def measure(name, items, run, setup=None):
+    """
+    Run the benchmark twice, first for timing and then under tracemalloc for
+    peak memory, and return the results as a dictionary.
+    """
+
+    state = setup() if setup else None
+    start = time.perf_counter()
+    run(state)
+    elapsed = time.perf_counter() - start
+
+    state = setup() if setup else None
+    tracemalloc.start()
+    run(state)
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "benchmark": name,
+        "items": items,
+        "seconds": elapsed,
+        "items_per_second": items / elapsed if elapsed else 0.0,
+        "peak_bytes": peak,
+    }
+
+
+def bench_update(workdir, stand_in, count):
+    """
+    Benchmark Gerrit.update fetching all pages into an empty cache.
+    """
+
+    filename = os.path.join(workdir, "update.json.gz")
+
+    def _setup():
+        if os.path.exists(filename):
+            os.remove(filename)
+        return Gerrit(Cache(filename), stand_in.url)
+
+    return measure("Gerrit.update", count, lambda g: g.update(), _setup)
+
+
+def bench_cache(workdir, cache_entries):
+    """
+    Benchmark Cache.write and Cache.read of the synthetic cache.
+    """
+
+    filename = os.path.join(workdir, "cache.json.gz")
+    count = len(cache_entries)
+
+    def _write(_):
+        cache = Cache(filename)
+        for change in cache_entries:
+            cache.append(change)
+        cache.write()
+
+    results = [measure("Cache.write", count, _write)]
+    results.append(measure("Cache.read", count, lambda _: Cache(filename).read()))
+    return results
+
+
+def bench_store(cache_entries):
+    """
+    Benchmark building the ColumnStore from the synthetic cache, and
+    summarizing it the way weekly and monthly summaries do.
+    """
+
+    cache = Cache(None)
+    for change in cache_entries:
+        cache.append(change)
+    count = len(cache_entries)
+
+    def _build(_):
+        ColumnStore.from_cache(cache)
+
+    results = [measure("ColumnStore.from_cache", count, _build)]
+
+    store = ColumnStore.from_cache(cache)
+
+    def _summarize(_):
+        for group_by in ColumnStore.GROUPS:
+            store.summarize(group_by, days=7)
+            store.summarize(group_by, days=30)
+        store.summarize("author", days=30, domain=DOMAINS[0])
+
+    results.append(measure("ColumnStore.summarize", count, _summarize))
+    return results
+
+
+def bench_format(users):
+    """
+    Benchmark OutputFormatter.format_html for all synthetic users.
+    """
+
+    conf = Config()
+    view = DailyView(conf.view_filename)
+    view.read()
+    loaded = [load_user(f"user{x}") for x in range(users)]
+
+    def _run(_):
+        for (user, css) in loaded:
+            OutputFormatter(
+                view, conf.project, conf.gerrit_url, css, user.FILTERS
+            ).format_html()
+
+    return measure("OutputFormatter.format_html", users, _run)
+
+
+def bench_mailer(workdir, sink, users):
+    """
+    Benchmark Mailer.main sending emails to all synthetic users, checking
+    that the smtp sink received all of them.
+    """
+
+    params = argparse.Namespace(
+        debug=False,
+        all=True,
+        user=None,
+        gpg_recipient=None,
+        spool_only=False,
+        drain=False,
+    )
+
+    def _setup():
+        shutil.rmtree(os.path.join(workdir, "outbox"), ignore_errors=True)
+        return Mailer(params)
+
+    def _run(mailer):
+        received = sink.received
+        mailer.main()
+        if sink.received - received != users:
+            raise RuntimeError(
+                f"smtp sink received {sink.received - received} of {users} emails"
+            )
+
+    return measure("Mailer.main", users, _run, _setup)
+
+
+def start_servers(params, changes_count):
+    """
+    Start the Gerrit stand-in, serving fixtures or synthetic changes, and the
+    smtp sink. Return the changes served along with both servers.
+    """
+
+    if params.fixtures:
+        stand_in = GerritStandIn(fixtures=params.fixtures)
+        changes = []
+        for page in stand_in.pages.values():
+            changes += json.loads(page[5:])
+    else:
+        changes = synthetic_changes(changes_count)
+        stand_in = GerritStandIn(pages=synthetic_pages(changes, params.page_size))
+    sink = SmtpSink()
+    for server in (stand_in, sink):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return (changes, stand_in, sink)
+
+
+def make_workdir(stand_in, sink, workers):
+    """
+    Create a temporary working directory with a config.yaml pointing to the
+    stand-in servers.
+    """
+
+    workdir = tempfile.mkdtemp(prefix="aosp-digest-benchmark-")
+    with open(os.path.join(workdir, "config.yaml"), "w") as fconfig:
+        fconfig.write(
+            "gerrit:\n"
+            "  project: Benchmark\n"
+            f"  url: {stand_in.url}\n"
+            "  cache_filename: cache.json.gz\n"
+            "smtp:\n"
+            f"  url: {sink.url}\n"
+            "  authentication: False\n"
+            "  uname: ''\n"
+            "  from: digest@example.com\n"
+            f"  workers: {workers}\n"
+        )
+    return workdir
+
+
+def run_in_workdir(workdir, stand_in, sink, cache_entries, users_counts, css):
+    """
+    Run the benchmarks from within the working directory: the cache
+    dependent ones once, and the user dependent ones for each of given
+    numbers of users.
+    """
+
+    results = [bench_update(workdir, stand_in, len(cache_entries))]
+    results += bench_cache(workdir, cache_entries)
+    results += bench_store(cache_entries)
+    for result in results:
+        result["users"] = 0
+
+    conf = Config()
+    cache = Cache(conf.cache_filename)
+    cache.read()
+    Gerrit(cache, conf.gerrit_url).get_cached_today()
+    view = DailyView(conf.view_filename)
+    view.build(cache, conf.gerrit_url)
+    view.write()
+
+    projects = sorted({x["project"] for x in cache_entries})
+    for users_count in users_counts:
+        write_users(workdir, users_count, projects, css)
+        for result in (
+            bench_format(users_count),
+            bench_mailer(workdir, sink, users_count),
+        ):
+            result["users"] = users_count
+            results.append(result)
+    return results
+
+
+def run_benchmarks(params, changes_count, users_counts):
+    """
+    Run all benchmarks for given size of cache, and the user dependent ones
+    for each of given numbers of users.
+    """
+
+    (changes, stand_in, sink) = start_servers(params, changes_count)
+    cache_entries = synthetic_cache(changes)
+    with open(os.path.join("users", "default.css")) as fcss:
+        css = fcss.read()
+    origin = os.getcwd()
+    workdir = make_workdir(stand_in, sink, params.workers)
+    try:
+        os.chdir(workdir)
+        results = run_in_workdir(
+            workdir, stand_in, sink, cache_entries, users_counts, css
+        )
+    finally:
+        os.chdir(origin)
+        shutil.rmtree(workdir, ignore_errors=True)
+        for server in (stand_in, sink):
+            server.shutdown()
+            server.server_close()
+
+    for result in results:
+        result["changes"] = len(cache_entries)
+    return results
+
+
+def record(fixtures):
+    """
+    Record replies of the Gerrit instance from config.yaml into fixtures,
+    running Gerrit.update against a recording stand-in.
+    """
+
+    conf = Config()
+    stand_in = GerritStandIn(fixtures=fixtures, upstream=conf.gerrit_url)
+    threading.Thread(target=stand_in.serve_forever, daemon=True).start()
+    workdir = tempfile.mkdtemp(prefix="aosp-digest-record-")
+    try:
+        Gerrit(Cache(os.path.join(workdir, "cache.json.gz")), stand_in.url).update()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        stand_in.shutdown()
+        stand_in.server_close()
+    logging.info("Recorded %d pages into %s", len(stand_in.pages), fixtures)
+
+
+def main():
+    """
+    See module docstring.
+    """
+
+    logging.basicConfig(format="%(message)s", level=logging.WARNING)
+    args = argparse.ArgumentParser(
+        description="Benchmark aosp-digest against local Gerrit and smtp stand-ins."
+    )
+    args.add_argument(
+        "-c",
+        "--changes",
+        default="1000,10000",
+        help="comma separated sizes of the synthetic cache (default: 1000,10000)",
+    )
+    args.add_argument(
+        "-u",
+        "--users",
+        default="10,100",
+        help="comma separated numbers of synthetic users (default: 10,100)",
+    )
+    args.add_argument(
+        "--page_size",
+        type=int,
+        default=PAGE_SIZE,
+        help=f"changes per synthetic Gerrit page (default: {PAGE_SIZE})",
+    )
+    args.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="concurrent smtp connections (default: 4)",
+    )
+    args.add_argument(
+        "--fixtures",
+        help="replay Gerrit pages recorded in this directory instead of "
+        "synthetic changes",
+    )
+    args.add_argument(
+        "--record",
+        metavar="FIXTURES",
+        help="record Gerrit pages into this directory and exit",
+    )
+    args.add_argument(
+        "-o",
+        "--output",
+        help="append results as json lines to a file",
+    )
+    params = args.parse_args()
+
+    if params.record:
+        logging.getLogger().setLevel(logging.INFO)
+        record(params.record)
+        return
+
+    changes_counts = [int(x) for x in params.changes.split(",")]
+    if params.fixtures:
+        changes_counts = changes_counts[:1]
+    users_counts = [int(x) for x in params.users.split(",")]
+    results = []
+    for changes_count in changes_counts:
+        results += run_benchmarks(params, changes_count, users_counts)
+
+    print(
+        f"{'benchmark':<28} {'changes':>8} {'users':>6} {'items':>8} "
+        f"{'seconds':>9} {'items/s':>11} {'peak MiB':>9}"
+    )
+    for result in results:
+        print(
+            f"{result['benchmark']:<28} {result['changes']:>8} {result['users']:>6} "
+            f"{result['items']:>8} {result['seconds']:>9.3f} "
+            f"{result['items_per_second']:>11.1f} "
+            f"{result['peak_bytes'] / 2 ** 20:>9.1f}"
+        )
+    if params.output:
+        with open(params.output, "a") as foutput:
+            for result in results:
+                foutput.write(json.dumps(result, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,8 @@ import gzip
 import json
 from os import path
 
+from instrumentation import METRICS
+
 
 class Cache:
     """
@@ -20,7 +22,7 @@ class Cache:
 
     def __init__(self, filename):
         self._filename = filename
-        self._data = {}
+        self._data = []
 
     def read(self):
         """
@@ -30,11 +32,12 @@ class Cache:
         if not path.exists(self._filename):
             self._data = []
         else:
-            fcache = gzip.open(self._filename, "rb")
-            try:
-                self._data = json.load(fcache)
-            finally:
-                fcache.close()
+            with METRICS.timer("cache_read"):
+                fcache = gzip.open(self._filename, "rb")
+                try:
+                    self._data = json.load(fcache)
+                finally:
+                    fcache.close()
 
     def write(self):
         """
@@ -42,15 +45,17 @@ class Cache:
         and archive in a gzip file.
         """
 
-        fcache = gzip.open(self._filename, "wb")
-        try:
-            fcache.write(
-                bytearray(
-                    json.dumps(self._data, indent=4, sort_keys=True), encoding="utf-8"
+        with METRICS.timer("cache_write"):
+            fcache = gzip.open(self._filename, "wb")
+            try:
+                fcache.write(
+                    bytearray(
+                        json.dumps(self._data, indent=4, sort_keys=True),
+                        encoding="utf-8",
+                    )
                 )
-            )
-        finally:
-            fcache.close()
+            finally:
+                fcache.close()
 
     # pylint: disable=missing-docstring
     def filter_key(self, key):
@@ -68,5 +73,8 @@ class Cache:
     def get_by_predicate(self, predicate):
         return [x for x in self._data if predicate(x)]
 
+    def get_all(self):
+        return list(self._data)
+
     def append(self, change):
         self._data.append(change)
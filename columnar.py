@@ -0,0 +1,138 @@
+#
+# Copyright 2021 Sony Mobile Communications Inc.
+# SPDX-License-Identifier: MIT
+#
+"""
+Columnar representation of the cache for aggregate queries, e.g. changes per
+project, top authors of a domain, or insertion/deletion totals over the last
+week:
+- timestamps, insertions and deletions are kept in typed arrays
+- projects, authors and author domains are dictionary encoded, i.e. kept as
+  arrays of integer codes indexing a list of distinct values
+- rows are ordered by the 'updated' timestamp (UTC, as reported by Gerrit),
+  so a time window is a slice
+"""
+import bisect
+import time
+from array import array
+from collections import Counter
+from datetime import datetime, timezone
+from functools import reduce
+from itertools import compress
+from operator import and_
+
+from instrumentation import METRICS
+
+
+class ColumnStore:
+    """
+    See file docstring.
+    """
+
+    GROUPS = ("project", "author", "domain")
+
+    def __init__(self):
+        self.updated = array("d")
+        self.insertions = array("q")
+        self.deletions = array("q")
+        self.codes = {key: array("l") for key in self.GROUPS}
+        self.values = {key: [] for key in self.GROUPS}
+
+    def __len__(self):
+        return len(self.updated)
+
+    @classmethod
+    def from_cache(cls, cache):
+        """
+        Build the columns from all changes of given cache.
+        """
+
+        store = cls()
+        with METRICS.timer("store_build"):
+            encoding = {key: {} for key in cls.GROUPS}
+            for change in sorted(cache.get_all(), key=lambda x: x["updated"]):
+                email = change["author"]["email"]
+                values = {
+                    "project": change["project"],
+                    "author": email,
+                    "domain": email.rpartition("@")[2],
+                }
+                for key in cls.GROUPS:
+                    codes = encoding[key]
+                    store.codes[key].append(codes.setdefault(values[key], len(codes)))
+                updated = datetime.fromisoformat(change["updated"][:19])
+                store.updated.append(updated.replace(tzinfo=timezone.utc).timestamp())
+                (insertions, deletions) = change["size"]
+                store.insertions.append(insertions)
+                store.deletions.append(deletions)
+            for key in cls.GROUPS:
+                store.values[key] = list(encoding[key])
+        return store
+
+    def _mask(self, key, wanted, start):
+        codes = {
+            code for (code, value) in enumerate(self.values[key]) if value in wanted
+        }
+        return bytes(map(codes.__contains__, self.codes[key][start:]))
+
+    def _select(self, start, group_by, projects, domain):
+        """
+        Return group codes (None if not grouped), insertions and deletions of
+        the rows from `start` on, restricted to given projects and domain.
+        """
+
+        insertions = self.insertions[start:]
+        deletions = self.deletions[start:]
+        keys = self.codes[group_by][start:] if group_by else None
+        masks = []
+        if projects is not None:
+            masks.append(self._mask("project", set(projects), start))
+        if domain is not None:
+            masks.append(self._mask("domain", {domain}, start))
+        if masks:
+            mask = reduce(lambda x, y: bytes(map(and_, x, y)), masks)
+            insertions = array("q", compress(insertions, mask))
+            deletions = array("q", compress(deletions, mask))
+            if keys is not None:
+                keys = array("l", compress(keys, mask))
+        return (keys, insertions, deletions)
+
+    def _group(self, group_by, keys, insertions, deletions, top):
+        labels = self.values[group_by]
+        changes = Counter(keys)
+        inserted = [0] * len(labels)
+        deleted = [0] * len(labels)
+        for (key, plus, minus) in zip(keys, insertions, deletions):
+            inserted[key] += plus
+            deleted[key] += minus
+
+        return [
+            (labels[key], count, inserted[key], deleted[key])
+            for (key, count) in changes.most_common(top)
+        ]
+
+    def summarize(self, group_by=None, days=None, projects=None, domain=None, top=None):
+        """
+        Return rows (label, changes, insertions, deletions) ordered by the
+        number of changes, at most `top` of them if given, where:
+        - group_by = "project", "author", "domain" or None for a single
+          row of totals labelled "All"
+        - days = only count changes updated during the last `days` days
+        - projects = only count changes of given projects
+        - domain = only count changes of authors from given domain
+        """
+
+        with METRICS.timer("store_summarize"):
+            start = 0
+            if days is not None:
+                start = bisect.bisect_left(self.updated, time.time() - days * 86400)
+
+            (keys, insertions, deletions) = self._select(
+                start, group_by, projects, domain
+            )
+            if keys is None:
+                if not insertions:
+                    return []
+                return [("All", len(insertions), sum(insertions), sum(deletions))]
+
+            return self._group(group_by, keys, insertions, deletions, top)
@@ -16,19 +16,24 @@ class SmtpConfig:
     - authentication = True if smtp server requires authentication
     - uname = user name used for authentication on smtp_url
     - from_address = 'From:' email address
+    - outbox = directory of the outbox spooling rendered emails
+    - workers = number of concurrent smtp connections draining the outbox
     """
 
-    def __init__(self, url, authentication, uname, from_address):
+    def __init__(self, url, authentication, uname, from_address, outbox, workers):
         self.url = url
         self.authentication = authentication
         self.uname = uname
         self.from_address = from_address
+        self.outbox = outbox
+        self.workers = workers
 
 
 class Config:
     """
     Configuration class for runtime parameters:
     - cache = filename of the cache file
+    - view = filename of today's view, defaults to the cache filename + '.today'
     - gerrit = url to the gerrit insance to inspect
     - smtp = SmtpConfig instance
     """
@@ -37,6 +42,9 @@ class Config:
         with open("config.yaml") as fconfig:
             config = yaml.safe_load(fconfig)
             self.cache_filename = config["gerrit"]["cache_filename"]
+            self.view_filename = config["gerrit"].get(
+                "view_filename", self.cache_filename + ".today"
+            )
             self.gerrit_url = config["gerrit"]["url"]
             self.project = config["gerrit"]["project"]
             self.smtp = SmtpConfig(
@@ -44,4 +52,6 @@ class Config:
                 config["smtp"]["authentication"],
                 config["smtp"]["uname"],
                 config["smtp"]["from"],
+                config["smtp"].get("outbox", "outbox"),
+                config["smtp"].get("workers", 4),
             )
@@ -0,0 +1,100 @@
+#
+# Copyright 2021 Sony Mobile Communications Inc.
+# SPDX-License-Identifier: MIT
+#
+"""
+Provides a precomputed view over the changes cached today:
+- changes bucketed by project, each with its author domain
+- pre-rendered html fragment for every change
+- read/write the view from/to a gzip file
+
+The view is written by update_cache.py next to the cache, so send_email.py
+only needs to load today's changes instead of the whole cache.
+"""
+import datetime
+import gzip
+import json
+import logging
+import os
+import zlib
+
+from instrumentation import METRICS
+from output_formatter import OutputFormatter
+
+
+class DailyView:
+    """
+    See file docstring.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._data = {"date": None, "projects": {}}
+
+    @staticmethod
+    def _today():
+        return datetime.datetime.now().strftime("%Y-%m-%d")
+
+    def read(self):
+        """
+        Read a gzip file and unpack into a json object. A missing or
+        unreadable file leaves the view empty.
+        """
+
+        if os.path.exists(self._filename):
+            with METRICS.timer("view_read"):
+                try:
+                    with gzip.open(self._filename, "rb") as fview:
+                        self._data = json.load(fview)
+                except (OSError, EOFError, zlib.error, ValueError) as err:
+                    logging.warning("Ignoring unreadable view: %s", str(err))
+                    self._data = {"date": None, "projects": {}}
+
+    def write(self):
+        """
+        Dump the view into a compact json archived in a gzip file. The file
+        is replaced atomically, so an interrupted write never truncates it.
+        """
+
+        with METRICS.timer("view_write"):
+            with gzip.open(self._filename + ".tmp", "wb") as fview:
+                fview.write(
+                    bytearray(
+                        json.dumps(self._data, separators=(",", ":"), sort_keys=True),
+                        encoding="utf-8",
+                    )
+                )
+            os.replace(self._filename + ".tmp", self._filename)
+
+    def build(self, cache, anchor):
+        """
+        Bucket today's changes from given cache by project, add their author
+        domain, and pre-render each change into html linking to `anchor`.
+        """
+
+        with METRICS.timer("view_build"):
+            projects = {}
+            for change in cache.get_all():
+                change = dict(change)
+                change["domain"] = change["author"]["email"].rpartition("@")[2]
+                change["html"] = OutputFormatter.format_change(change, anchor)
+                projects.setdefault(change["project"], []).append(change)
+
+            for changes in projects.values():
+                changes.sort(key=lambda x: x["number"])
+            self._data = {"date": self._today(), "projects": projects}
+
+    def is_today(self):
+        """
+        Return True if the view was built today.
+        """
+        return self._data["date"] == self._today()
+
+    # pylint: disable=missing-docstring
+    def group_by_predicate(self, predicate):
+        node = []
+        for (project, changes) in self._data["projects"].items():
+            matches = [x for x in changes if predicate(x)]
+            if matches:
+                node.append((project, matches))
+        return node
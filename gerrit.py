@@ -12,6 +12,8 @@ import json
 
 import requests
 
+from instrumentation import METRICS
+
 
 class Gerrit:
     """
@@ -32,9 +34,13 @@ class Gerrit:
             "Content-Type": "application/json",
             "Accept-Type": "application/json",
         }
-        response = requests.get(self._url + cmd, headers=headers)
-        clean = _wash_gerrit_reply(response.text)
-        return json.loads(clean)
+        with METRICS.timer("gerrit_fetch"):
+            response = requests.get(self._url + cmd, headers=headers)
+        METRICS.count("gerrit_pages")
+        METRICS.count("gerrit_bytes_received", len(response.content))
+        with METRICS.timer("gerrit_json_parse"):
+            clean = _wash_gerrit_reply(response.text)
+            return json.loads(clean)
 
     def _fetch(self, cmd):
         everything = list()
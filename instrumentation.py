@@ -0,0 +1,218 @@
+#
+# Copyright 2021 Sony Mobile Communications Inc.
+# SPDX-License-Identifier: MIT
+#
+"""
+Timers and counters for the phases of update_cache.py and send_email.py:
+- every measurement is emitted as a json line into a metrics file
+- aggregated measurements are optionally written into a Prometheus textfile
+- optionally, the whole run is profiled using cProfile or tracemalloc
+
+Measurements are taken through the module-wide METRICS instance, e.g.:
+    with METRICS.timer("cache_read"):
+        ...
+    METRICS.count("gerrit_bytes_received", len(response.content))
+"""
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+PROFILERS = ("cprofile", "tracemalloc")
+
+
+class Metrics:
+    """
+    See file docstring.
+    """
+
+    _PREFIX = "aosp_digest_"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stream = None
+        self._entry = None
+        self._timers = {}
+        self._counters = {}
+        self._gauges = {}
+
+    def open(self, entry, filename):
+        """
+        Start emitting measurements of given entry point as json lines
+        appended to filename ('-' for stderr).
+        """
+
+        self._entry = entry
+        if filename == "-":
+            self._stream = sys.stderr
+        elif filename:
+            self._stream = open(filename, "a")
+
+    def close(self):
+        """
+        Stop emitting measurements.
+        """
+
+        if self._stream and self._stream is not sys.stderr:
+            self._stream.close()
+        self._stream = None
+
+    def _emit(self, kind, name, value, labels):
+        if not self._stream:
+            return
+        line = {
+            "time": datetime.now().isoformat(),
+            "entry": self._entry,
+            "type": kind,
+            "metric": name,
+            "value": value,
+        }
+        line.update(labels)
+        self._stream.write(json.dumps(line, sort_keys=True) + "\n")
+        self._stream.flush()
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """
+        Measure the wall clock time spent in the with-block.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            key = (name, tuple(sorted(labels.items())))
+            with self._lock:
+                count, total = self._timers.get(key, (0, 0.0))
+                self._timers[key] = (count + 1, total + elapsed)
+                self._emit("timer", name, elapsed, labels)
+
+    def count(self, name, value=1, **labels):
+        """
+        Increase the counter by value.
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._emit("counter", name, value, labels)
+
+    def gauge(self, name, value, **labels):
+        """
+        Emit a single value, e.g. resource usage at the end of the run.
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+            self._emit("gauge", name, value, labels)
+
+    def write_prometheus(self, filename):
+        """
+        Write aggregated timers, counters and gauges into a Prometheus
+        textfile. The file is replaced atomically, as expected by the
+        textfile collector.
+        """
+
+        def _labels(labels):
+            if not labels:
+                return ""
+            pairs = ",".join(f'{k}="{v}"' for (k, v) in labels)
+            return "{" + pairs + "}"
+
+        def _series(values, suffix, kind):
+            for name in sorted({name for (name, _) in values}):
+                metric = f"{self._PREFIX}{name}{suffix}"
+                yield f"# TYPE {metric} {kind}"
+                for ((key, labels), value) in sorted(values.items()):
+                    if key != name:
+                        continue
+                    if kind == "summary":
+                        (count, total) = value
+                        yield f"{metric}_sum{_labels(labels)} {total}"
+                        yield f"{metric}_count{_labels(labels)} {count}"
+                    else:
+                        yield f"{metric}{_labels(labels)} {value}"
+
+        with self._lock:
+            lines = list(_series(self._timers, "_seconds", "summary"))
+            lines += _series(self._counters, "_total", "counter")
+            lines += _series(self._gauges, "", "gauge")
+
+        with open(filename + ".tmp", "w") as fprom:
+            fprom.write("\n".join(lines) + "\n")
+        os.replace(filename + ".tmp", filename)
+
+
+METRICS = Metrics()
+
+
+def add_arguments(parser):
+    """
+    Add instrumentation options to an argparse parser.
+    """
+
+    parser.add_argument(
+        "--metrics",
+        help="append timers and counters as json lines to a file ('-' for stderr)",
+    )
+    parser.add_argument(
+        "--prometheus",
+        help="write aggregated timers and counters into a Prometheus textfile",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILERS,
+        help="profile the run and log the results",
+    )
+
+
+@contextlib.contextmanager
+def instrumented(entry, metrics=None, prometheus=None, profile=None):
+    """
+    Measure the run of an entry point: emit its measurements into the
+    metrics file, write the Prometheus textfile at the end, and profile
+    the run if requested.
+    """
+
+    METRICS.open(entry, metrics)
+    profiler = None
+    if profile == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profile == "tracemalloc":
+        tracemalloc.start()
+
+    try:
+        with METRICS.timer("run", entry=entry):
+            yield
+    finally:
+        if profiler:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(25)
+            logging.info(out.getvalue())
+        elif profile == "tracemalloc":
+            snapshot = tracemalloc.take_snapshot()
+            (_, peak) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            logging.info("Peak traced memory: %d bytes", peak)
+            for stat in snapshot.statistics("lineno")[:10]:
+                logging.info(str(stat))
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        METRICS.gauge("max_rss_bytes", usage.ru_maxrss * 1024, entry=entry)
+        METRICS.gauge("cpu_seconds", usage.ru_utime + usage.ru_stime, entry=entry)
+        if prometheus:
+            METRICS.write_prometheus(prometheus)
+        METRICS.close()
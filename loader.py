@@ -9,7 +9,8 @@ in `users/<user>.py` files with the following constants:
  - FILTERS = list of filters over cached changes. Filter consists of pairs
     (title, predicate), where:
       - title = string representing section title of the filtered cache content
-      - predicate = boolean function used to filter the cache content
+      - predicate = boolean function used to filter the cache content, or
+        output_formatter.Summary of the whole cache
 In order to expose these constants, load specified user configuration as a module.
 """
 import importlib.util
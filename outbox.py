@@ -0,0 +1,174 @@
+#
+# Copyright 2021 Sony Mobile Communications Inc.
+# SPDX-License-Identifier: MIT
+#
+"""
+Maildir-style outbox decoupling email rendering from smtp delivery:
+- spool a rendered email message into the outbox
+- drain the outbox by delivering spooled messages concurrently, with retry
+  and backoff
+
+Spooling a message first reserves its key by exclusively creating a marker
+in `keys/`, so overlapping runs never spool the same message twice. The
+message is then written into a uniquely named file in `tmp/` and atomically
+moved into `new/` when complete. Before delivery, a drain claims a message
+by atomically moving it into `sending/`, so concurrent drains never send the
+same message. A delivered message is moved into `cur/`, a message rejected
+permanently by the smtp server into `failed/`, and an undelivered one back
+into `new/`, so draining or spooling the same message again never sends it
+twice. Messages in `failed/` are never retried. A message left in `sending/`
+by an interrupted drain may or may not have been sent, and has to be moved
+back into `new/` by hand to be sent again. Delivered messages and their keys
+are removed when draining, once older than `keep_days`; failed messages are
+kept for inspection and have to be removed by hand.
+"""
+import email
+import email.policy
+import logging
+import os
+import smtplib
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import METRICS
+
+
+class Outbox:
+    """
+    See file docstring.
+    """
+
+    def __init__(self, dirname):
+        self._dirname = dirname
+        for subdir in ("keys", "tmp", "new", "sending", "cur", "failed"):
+            os.makedirs(os.path.join(dirname, subdir), exist_ok=True)
+
+    def _path(self, subdir, key):
+        return os.path.join(self._dirname, subdir, key)
+
+    def spool(self, key, msg):
+        """
+        Write the message under the given key into the outbox. Return False if
+        a message with the same key was already spooled.
+        """
+
+        try:
+            os.close(os.open(self._path("keys", key), os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
+            return False
+
+        try:
+            (fd, tmpname) = tempfile.mkstemp(
+                prefix=key + ".", dir=os.path.join(self._dirname, "tmp")
+            )
+            with os.fdopen(fd, "wb") as fmsg:
+                fmsg.write(msg.as_bytes())
+                fmsg.flush()
+                os.fsync(fmsg.fileno())
+            os.rename(tmpname, self._path("new", key))
+        except OSError:
+            # release the key, so the message can be spooled again
+            os.unlink(self._path("keys", key))
+            raise
+        return True
+
+    def pending(self):
+        """
+        Return keys of spooled messages that were not delivered yet.
+        """
+        return sorted(os.listdir(os.path.join(self._dirname, "new")))
+
+    @staticmethod
+    def _is_permanent(err):
+        if isinstance(err, smtplib.SMTPRecipientsRefused):
+            return True
+        return isinstance(err, smtplib.SMTPResponseException) and err.smtp_code >= 500
+
+    def _send(self, key, msg, smtp_config, password, attempts, backoff):
+        """
+        Return the subdirectory the message belongs to after sending it.
+        """
+
+        for attempt in range(1, attempts + 1):
+            try:
+                with METRICS.timer("smtp_send"):
+                    with smtplib.SMTP(smtp_config.url) as smtp:
+                        if smtp_config.authentication:
+                            smtp.ehlo()
+                            smtp.login(smtp_config.uname, password)
+                        smtp.send_message(msg)
+                return "cur"
+            except (smtplib.SMTPException, OSError) as err:
+                if self._is_permanent(err):
+                    METRICS.count("smtp_failures")
+                    logging.error("Email %s rejected: %s", key, str(err))
+                    return "failed"
+                if attempt == attempts:
+                    METRICS.count("smtp_failures")
+                    logging.error("Could not send email %s: %s", key, str(err))
+                    return "new"
+                METRICS.count("smtp_retries")
+                logging.warning(
+                    "Sending email %s failed (attempt %d): %s", key, attempt, str(err)
+                )
+                time.sleep(backoff * 2 ** (attempt - 1))
+        return "new"
+
+    def _deliver(self, key, smtp_config, password, attempts, backoff):
+        try:
+            os.rename(self._path("new", key), self._path("sending", key))
+        except FileNotFoundError:
+            # already claimed by another drain
+            return False
+
+        with open(self._path("sending", key), "rb") as fmsg:
+            msg = email.message_from_binary_file(fmsg, policy=email.policy.default)
+
+        subdir = self._send(key, msg, smtp_config, password, attempts, backoff)
+        os.rename(self._path("sending", key), self._path(subdir, key))
+        if subdir == "cur":
+            METRICS.count("smtp_sent")
+            return True
+        return False
+
+    def expire(self, days):
+        """
+        Remove delivered messages and keys spooled more than `days` days ago.
+        """
+
+        deadline = time.time() - days * 86400
+        for subdir in ("cur", "keys"):
+            for key in os.listdir(os.path.join(self._dirname, subdir)):
+                try:
+                    if os.path.getmtime(self._path(subdir, key)) < deadline:
+                        os.unlink(self._path(subdir, key))
+                except FileNotFoundError:
+                    # already removed by another drain
+                    pass
+
+    def drain(
+        self, smtp_config, password, workers=4, attempts=3, backoff=1.0, keep_days=30
+    ):
+        """
+        Deliver all pending messages using given smtp configuration and
+        password, using `workers` concurrent smtp connections. A message is
+        tried `attempts` times, waiting `backoff` seconds after the first
+        failure and doubling the wait after each subsequent one, unless the
+        smtp server rejects it permanently (5xx): such messages are moved into
+        `failed/`. Other messages which could not be delivered stay pending
+        for the next drain. Delivered messages older than `keep_days` days
+        are removed afterwards.
+        Return the number of delivered messages.
+        """
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                lambda key: self._deliver(
+                    key, smtp_config, password, attempts, backoff
+                ),
+                self.pending(),
+            )
+            delivered = sum(1 for sent in results if sent)
+        self.expire(keep_days)
+        return delivered
@@ -3,13 +3,44 @@
 # SPDX-License-Identifier: MIT
 #
 """
-Format cached Gerrit structure in an:
+Format today's view of the cached Gerrit structure, and summaries of the
+whole cache, in an:
 - html appropriate for email display.
 - json appropriate for debug
 """
 import json
 
 
+class Summary:
+    """
+    Section summarizing changes of the whole cache, used in place of a
+    predicate in user's FILTERS, e.g.
+    ("Top authors this week", Summary(group_by="author", days=7, top=10)):
+    - group_by = "project", "author", "domain" or None for totals only
+    - days = only count changes updated during the last `days` days
+    - top = maximal number of rows, the ones with most changes first
+    - projects = only count changes of given projects
+    - domain = only count changes of authors from given domain
+    """
+
+    def __init__(self, group_by=None, days=None, top=None, projects=None, domain=None):
+        self.group_by = group_by
+        self.days = days
+        self.top = top
+        self.projects = projects
+        self.domain = domain
+
+    def rows(self, store):
+        """
+        Return rows (label, changes, insertions, deletions) of given
+        ColumnStore.
+        """
+
+        return store.summarize(
+            self.group_by, self.days, self.projects, self.domain, self.top
+        )
+
+
 class OutputFormatter:
     """
     See file docstring.
@@ -41,60 +72,89 @@ class OutputFormatter:
 </html>
 """
 
-    def __init__(self, cache, project, anchor, css, filters):
+    # keys added to changes by the daily view, not part of the cached change
+    _VIEW_KEYS = ("domain", "html")
+
+    # kinds of sections in the tree
+    _CHANGES = "changes"
+    _SUMMARY = "summary"
+
+    def __init__(self, view, project, anchor, css, filters, store=None):
         self._project = project
-        self._cache = cache
         self._anchor = anchor
         self._css = css
-        self._filters = filters
+        self._tree = self._filter_cache(view, filters, store)
+
+    @staticmethod
+    def format_size(size):
+        """
+        Return a size string for the (insertions, deletions) pair of a change.
+        """
+
+        (insertions, deletions) = size
+        if insertions > 0 and deletions > 0:
+            out = f"(+{insertions},&nbsp;-{deletions})"
+        elif insertions > 0:
+            out = f"(+{insertions})"
+        elif deletions > 0:
+            out = f"(-{deletions})"
+        else:
+            out = ""
+        return out
+
+    @staticmethod
+    def format_change(change, anchor):
+        """
+        Return the html list item of a single change, linking to `anchor`.
+        """
+
+        number = str(change["number"])
+        size = OutputFormatter.format_size(change["size"])
+        author = str(change["author"]["name"]).replace(" ", "&nbsp;")
+        email = str(change["author"]["email"])
+        subject = str(change["subject"])
+        html = "<li>"
+        html += f"<a href='{anchor}{number}'>{number}</a>"
+        html += f" {subject} {size} {author} &lt;{email}&gt;</li>\n"
+        return html
 
-    def _filter_cache(self):
+    def _filter_cache(self, view, filters, store):
         tree = []
-        for (title, predicate) in self._filters:
-            node = []
-            matches = self._cache.get_by_predicate(predicate)
-            for project in {x["project"] for x in matches}:
-                node.append((project, [x for x in matches if x["project"] == project]))
-            tree.append((title, node))
+        for (title, predicate) in filters:
+            if isinstance(predicate, Summary):
+                tree.append((title, self._SUMMARY, predicate.rows(store)))
+            else:
+                node = view.group_by_predicate(predicate)
+                tree.append((title, self._CHANGES, node))
         return tree
 
+    def _format_summary(self, rows):
+        html = ""
+        for (label, changes, insertions, deletions) in rows:
+            size = self.format_size((insertions, deletions))
+            plural = "change" if changes == 1 else "changes"
+            html += f"<li>{str(label)}: {changes} {plural} {size}</li>\n"
+        return html
+
     def _format_body(self):
-        tree = self._filter_cache()
+        tree = self._tree
         if not tree:
             raise Exception("No content")
 
         html = ""
-        for (title, node) in sorted(tree):
+        for (title, kind, node) in sorted(tree, key=lambda x: x[:2]):
             html += f"<h2>{str(title)}</h2>\n"
             html += "<ul>\n"
             if not node:
                 html += "<li>No changes</li>\n"
+            elif kind == self._SUMMARY:
+                html += self._format_summary(node)
             else:
                 for (project, changes) in sorted(node):
                     html += f"<li>{str(project)}\n"
                     html += "<ul>\n"
-                    for change in sorted(changes, key=lambda x: x["number"]):
-
-                        def _format_size(chgs):
-                            (insertions, deletions) = chgs
-                            if insertions > 0 and deletions > 0:
-                                out = f"(+{insertions},&nbsp;-{deletions})"
-                            elif insertions > 0:
-                                out = f"(+{insertions})"
-                            elif deletions > 0:
-                                out = f"(-{deletions})"
-                            else:
-                                out = ""
-                            return out
-
-                        number = str(change["number"])
-                        size = _format_size(change["size"])
-                        author = str(change["author"]["name"]).replace(" ", "&nbsp;")
-                        email = str(change["author"]["email"])
-                        subject = str(change["subject"])
-                        html += "<li>"
-                        html += f"<a href='{self._anchor}{number}'>{number}</a>"
-                        html += f" {subject} {size} {author} &lt;{email}&gt;</li>\n"
+                    for change in changes:
+                        html += change["html"]
                     html += "</ul>\n"
                     html += "</li>\n"
             html += "</ul>\n"
@@ -102,8 +162,8 @@ class OutputFormatter:
 
     def format_html(self):
         """
-        Return a simple html for the body of report. Response from
-        Gerrit acquired from the cached json is munged into an html.
+        Return a simple html for the body of report. Changes from the
+        daily view are assembled from their pre-rendered html fragments.
         """
 
         return (
@@ -116,10 +176,19 @@ class OutputFormatter:
 
     def format_json(self):
         """
-        Return a json representation of underlying cache.
+        Return a json representation of underlying daily view.
         """
 
-        tree = self._filter_cache()
-        if not tree:
-            return json.dumps(dict(), indent=4, sort_keys=True)
-        return json.dumps(dict(tree), indent=4, sort_keys=True)
+        def _strip(change):
+            return {k: v for (k, v) in change.items() if k not in self._VIEW_KEYS}
+
+        tree = {}
+        for (title, kind, node) in self._tree:
+            if kind == self._SUMMARY:
+                tree[title] = node
+            else:
+                tree[title] = [
+                    (project, [_strip(x) for x in changes])
+                    for (project, changes) in node
+                ]
+        return json.dumps(tree, indent=4, sort_keys=True)
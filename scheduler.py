@@ -15,25 +15,44 @@ crontab equivalent:
 
 is to run this script with:
 ./scheduler.py -a -g <gpg-recipient> some.log 2>&1
+
+Use --metrics=<file> and --prometheus=<file> to emit the measurements of
+both steps of the job, see instrumentation.py.
 """
+import argparse
 import getopt
 import logging
-import os
 import sys
 import time
 
 import schedule
 
-# import send_email
+import send_email
 import update_cache
+from instrumentation import METRICS, instrumented
 
 
-def job(gpg_recipient):
+def job(gpg_recipient, metrics, prometheus):
     """
     Update the cache and send the email.
     """
-    update_cache.main()
-    os.system("exec send_email.py -a -g " + gpg_recipient)
+    params = argparse.Namespace(
+        debug=False,
+        all=True,
+        user=None,
+        gpg_recipient=gpg_recipient,
+        spool_only=False,
+        drain=False,
+    )
+    with instrumented("scheduler", metrics, prometheus):
+        with METRICS.timer("job", step="update_cache"):
+            update_cache.main()
+        with METRICS.timer("job", step="send_email"):
+            # an exception raised by a job would stop the scheduler
+            try:
+                send_email.Mailer(params).main()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Sending emails failed")
 
 
 def main():
@@ -41,9 +60,13 @@ def main():
     Take the parameters and schedule the job.
     """
     gpg_recipient = ""
+    metrics = None
+    prometheus = None
     logging.basicConfig(format="%(message)s", level=logging.INFO)
     try:
-        opts, _ = getopt.getopt(sys.argv[1:], "r:", ["rec="])
+        opts, _ = getopt.getopt(
+            sys.argv[1:], "r:", ["rec=", "metrics=", "prometheus="]
+        )
     except getopt.GetoptError as err:
         logging.error(str(err))
         sys.exit(1)
@@ -51,10 +74,14 @@ def main():
     for option, val in opts:
         if option in ("-r", "--rec"):
             gpg_recipient = val
+        elif option == "--metrics":
+            metrics = val
+        elif option == "--prometheus":
+            prometheus = val
         else:
             assert False, "unexpected option %s" % option
 
-    schedule.every().day.at("4:56").do(job, r=gpg_recipient)
+    schedule.every().day.at("4:56").do(job, gpg_recipient, metrics, prometheus)
 
     while True:
         schedule.run_pending()
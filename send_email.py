@@ -6,11 +6,15 @@
 """
 Send an email with an html body to a list of users -- OR --
 dump the intermediate jsons (intended for emails) for debugging.
+
+Rendered emails are spooled into the outbox first, and the outbox is
+drained afterwards, so a failed delivery can be retried with `--drain`
+without rendering the emails again.
 """
 import argparse
 import logging
 import os
-import smtplib
+import re
 import sys
 from datetime import datetime
 from email.message import EmailMessage
@@ -18,10 +22,29 @@ from email.message import EmailMessage
 import gnupg
 
 from cache import Cache
+from columnar import ColumnStore
 from config import Config
+from daily_view import DailyView
 from gerrit import Gerrit
+from instrumentation import METRICS, add_arguments, instrumented
 from loader import load_user
-from output_formatter import OutputFormatter
+from outbox import Outbox
+from output_formatter import OutputFormatter, Summary
+
+
+def decrypt_auth(gpg_recipient):
+    """
+    Decrypt the smtp password stored in the gpg safe storage of gpg_recipient.
+    """
+
+    gpg = gnupg.GPG(gnupghome=os.path.join(os.environ["HOME"], ".gnupg"))
+    with open(gpg_recipient + ".gpg", "rb") as fgpg, METRICS.timer("gpg_decrypt"):
+        decrypted_data = gpg.decrypt_file(fgpg)
+        if not decrypted_data.ok:
+            raise Exception(
+                f"failed to send mail: {decrypted_data.stderr}"  # pylint: disable=no-member
+            )
+    return str(decrypted_data).strip()
 
 
 class Recipient:
@@ -36,35 +59,40 @@ class Recipient:
         self._content = None
         self._filters = filters
 
-    def add_content(self, cache, project, url):
+    def wants_summaries(self):
         """
-        Add OutputFormatter containing cache filtered through
-        user's filters.
+        Return True if any of user's filters is a Summary of the whole cache.
         """
-        self._content = OutputFormatter(cache, project, url, self._css, self._filters)
+        return any(isinstance(x, Summary) for (_, x) in self._filters)
 
-    def send_email(self, project, smtp_config, gpg_recipient, dry_run):
+    def add_content(self, view, project, url, store):
         """
-        - EITHER: send an html email to Recipient using given smtp configuration
-                  and gpg_recipient (to get encrypted authentication info)
+        Add OutputFormatter containing today's view filtered through
+        user's filters, and summaries of the store of the whole cache.
+        """
+        with METRICS.timer("filter_evaluation", user=self._email):
+            self._content = OutputFormatter(
+                view, project, url, self._css, self._filters, store
+            )
+
+    def spool_email(self, project, smtp_config, outbox, dry_run):
+        """
+        - EITHER: spool an html email to Recipient into the outbox, using given
+                  smtp configuration
         - OR: if dry_run is set to true, dump the json into stdout.
         """
 
+        timenow = datetime.now()
+
         def _subject():
-            timenow = datetime.now()
             return f"{project} Gerrit digest {timenow.strftime('%A %d %B %Y')}"
 
-        def _decrypt_auth(gpg_recipient):
-            gpg = gnupg.GPG(gnupghome=os.path.join(os.environ["HOME"], ".gnupg"))
-            with open(gpg_recipient + ".gpg", "rb") as fgpg:
-                decrypted_data = gpg.decrypt_file(fgpg)
-                if not decrypted_data.ok:
-                    raise Exception(
-                        f"failed to send mail: {decrypted_data.stderr}"  # pylint: disable=no-member
-                    )
-            return str(decrypted_data).strip()
-
-        message = self._content.format_html()
+        def _key():
+            # one digest per recipient and day: spooling it again is a no-op
+            return re.sub(r"[^\w.@+-]", "_", f"{timenow:%Y-%m-%d}_{self._email}")
+
+        with METRICS.timer("html_render", user=self._email):
+            message = self._content.format_html()
         if dry_run:
             logging.info(self._email)
             logging.info(self._content.format_json())
@@ -79,12 +107,8 @@ class Recipient:
             "For the list of today's changes in AOSP Gerrit, please turn on HTML."
         )
         msg.add_alternative(message, subtype="html")
-        smtp = smtplib.SMTP(smtp_config.url)
-        if smtp_config.authentication:
-            smtp.ehlo()
-            pwd = _decrypt_auth(gpg_recipient)
-            smtp.login(smtp_config.uname, pwd)
-        smtp.send_message(msg)
+        if not outbox.spool(_key(), msg):
+            logging.info("Email for %s already spooled today", self._email)
 
 
 class Mailer:
@@ -98,11 +122,13 @@ class Mailer:
 
         self._dry_run = params.debug
         self._gpg_recipient = params.gpg_recipient
+        self._spool_only = params.spool_only
+        self._drain_only = params.drain
         self._users = set()
         if params.all:
             for path in [x for x in os.listdir("users") if x.endswith(".py")]:
                 self._add_user(path[:-3])
-        else:
+        elif params.user:
             if os.path.isfile(os.path.join("users", params.user + ".py")):
                 self._add_user(params.user)
             else:
@@ -122,6 +148,14 @@ class Mailer:
                 "Cannot send email for user %s: No formatting defined", username
             )
 
+    def _drain(self, smtp_config, outbox):
+        pwd = None
+        if smtp_config.authentication:
+            pwd = decrypt_auth(self._gpg_recipient)
+        delivered = outbox.drain(smtp_config, pwd, smtp_config.workers)
+        pending = len(outbox.pending())
+        logging.info("Sent %d emails, %d pending in outbox", delivered, pending)
+
     def main(self):
         """
         Send emails to requested users filed in the users folder (use '-a'
@@ -130,30 +164,55 @@ class Mailer:
         """
 
         conf = Config()
-        if conf.smtp.authentication and not self._gpg_recipient:
+        if (
+            conf.smtp.authentication
+            and not self._gpg_recipient
+            and not self._spool_only
+        ):
             logging.error("Cannot send email. SMTP authentication missing.")
             return
 
-        cache = Cache(conf.cache_filename)
-        cache.read()
-        gerrit = Gerrit(cache, conf.gerrit_url)
-        gerrit.get_cached_today()
+        if self._drain_only:
+            self._drain(conf.smtp, Outbox(conf.smtp.outbox))
+            return
+
+        cache = None
+        store = None
+        if any(user.wants_summaries() for user in self._users):
+            cache = Cache(conf.cache_filename)
+            cache.read()
+            store = ColumnStore.from_cache(cache)
+
+        view = DailyView(conf.view_filename)
+        view.read()
+        if not view.is_today():
+            # today's view is missing or stale: build it from the whole cache
+            if cache is None:
+                cache = Cache(conf.cache_filename)
+                cache.read()
+            gerrit = Gerrit(cache, conf.gerrit_url)
+            gerrit.get_cached_today()
+            view.build(gerrit.cache, conf.gerrit_url)
 
+        outbox = None if self._dry_run else Outbox(conf.smtp.outbox)
         for user in self._users:
             try:
-                user.add_content(gerrit.cache, conf.project, conf.gerrit_url)
-                user.send_email(
-                    conf.project, conf.smtp, self._gpg_recipient, self._dry_run
-                )
+                user.add_content(view, conf.project, conf.gerrit_url, store)
+                user.spool_email(conf.project, conf.smtp, outbox, self._dry_run)
             except IOError as err:
-                logging.error("Could not send email for user %s: %s", user, str(err))
+                logging.error("Could not spool email for user %s: %s", user, str(err))
+
+        if not self._dry_run and not self._spool_only:
+            self._drain(conf.smtp, outbox)
 
 
 if __name__ == "__main__":
     ARGS = argparse.ArgumentParser(
         description="Send an email with latest Gerrit changes to specific user."
     )
-    ARGS.add_argument(
+    # dry run, spooling and draining are separate modes of a run
+    MODES = ARGS.add_mutually_exclusive_group()
+    MODES.add_argument(
         "-d",
         "--debug",
         help="print debug information and don't send email",
@@ -175,9 +234,23 @@ if __name__ == "__main__":
         "--gpg_recipient",
         help="gnupg recipient of the gpg safe storage",
     )
+    MODES.add_argument(
+        "-s",
+        "--spool_only",
+        help="spool emails into the outbox without sending them",
+        action="store_true",
+    )
+    MODES.add_argument(
+        "-r",
+        "--drain",
+        help="only send emails already spooled in the outbox",
+        action="store_true",
+    )
+    add_arguments(ARGS)
     PARAMS = ARGS.parse_args()
-    if not PARAMS.all and not PARAMS.user:
+    if not PARAMS.all and not PARAMS.user and not PARAMS.drain:
         ARGS.print_help()
         sys.exit()
 
-    Mailer(PARAMS).main()
+    with instrumented("send_email", PARAMS.metrics, PARAMS.prometheus, PARAMS.profile):
+        Mailer(PARAMS).main()
@@ -5,10 +5,16 @@
 #
 """
 Fetch changes from a Gerrit server and cache the resulting json in a gzip file.
+Alongside the cache, write today's view of the cache used by send_email.py.
 """
+import argparse
+import logging
+
 from cache import Cache
 from config import Config
+from daily_view import DailyView
 from gerrit import Gerrit
+from instrumentation import add_arguments, instrumented
 
 
 def main():
@@ -19,7 +25,20 @@ def main():
     conf = Config()
     gerrit = Gerrit(Cache(conf.cache_filename), conf.gerrit_url)
     gerrit.update()
+    gerrit.get_cached_today()
+    view = DailyView(conf.view_filename)
+    view.build(gerrit.cache, conf.gerrit_url)
+    view.write()
 
 
 if __name__ == "__main__":
-    main()
+    ARGS = argparse.ArgumentParser(
+        description="Fetch changes from a Gerrit server and update the cache."
+    )
+    add_arguments(ARGS)
+    PARAMS = ARGS.parse_args()
+    logging.basicConfig(format="%(message)s", level=logging.INFO)
+    with instrumented(
+        "update_cache", PARAMS.metrics, PARAMS.prometheus, PARAMS.profile
+    ):
+        main()